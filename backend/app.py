@@ -3,14 +3,17 @@
 from contextlib import asynccontextmanager
 from pathlib import Path
 
+import orjson
 from fastapi import FastAPI
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 
 from backend.models import ChatRequest, ChatResponse
 from backend.rag import RAGPipeline
 
 rag: RAGPipeline | None = None
 
+STREAM_ERROR = "Something went wrong while generating the answer."
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -20,6 +23,7 @@ async def lifespan(app: FastAPI):
     print(f"RAG ready. {rag.chunk_count()} chunks indexed.")
     yield
     print("Shutting down.")
+    await rag.aclose()
 
 
 app = FastAPI(title="UrbanEmissions RAG", lifespan=lifespan)
@@ -34,8 +38,33 @@ async def serve_frontend():
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     history = [{"role": m.role, "content": m.content} for m in request.chat_history]
-    answer, sources = rag.query(request.question, history)
-    return ChatResponse(answer=answer, sources=sources)
+    answer, sources = await rag.aquery(request.question, history)
+    # With response_model set, FastAPI dumps the model straight to JSON bytes
+    # in pydantic-core; an existing instance isn't re-validated field by field.
+    return ChatResponse.model_construct(answer=answer, sources=sources)
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    history = [{"role": m.role, "content": m.content} for m in request.chat_history]
+
+    async def events():
+        try:
+            async for event in rag.astream(request.question, history):
+                if "sources" in event:
+                    event = {"sources": [s.model_dump() for s in event["sources"]]}
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band. The
+            # details stay in the server log, like a 500 on /api/chat.
+            print(f"Stream failed: {e!r}")
+            yield b"data: " + orjson.dumps({"error": STREAM_ERROR}) + b"\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @app.get("/api/health")
@@ -1,13 +1,15 @@
-"""RAG pipeline: retrieve from ChromaDB + generate with Gemini."""
+"""RAG pipeline: exact search over chunk embeddings + generate with Gemini."""
 
+import asyncio
 import os
-from collections import defaultdict
+import threading
+from collections.abc import AsyncIterator
 
+import numpy as np
 from google import genai
-from sentence_transformers import SentenceTransformer
 
 from backend.models import Source
-from indexer.embed import get_chroma_collection
+from indexer.embed import EMBED_DIM, get_embedder, load_search_index
 
 SYSTEM_PROMPT = """You are an expert assistant for urbanemissions.info, a comprehensive air pollution knowledge platform focused on India.
 
@@ -19,63 +21,219 @@ Answer the user's question using ONLY the provided context passages. Follow thes
 5. If multiple sources discuss the topic, synthesize the information coherently.
 6. Keep answers concise but thorough."""
 
+GEMINI_MODEL = "gemini-2.5-flash"
+NO_CONTEXT_ANSWER = (
+    "I couldn't find any relevant information from urbanemissions.info for this question."
+)
+# Returned when Gemini sends no text, e.g. a blocked or cut-off response
+NO_ANSWER = "I couldn't generate an answer to this question. Please try rephrasing it."
+
+# Semantic answer cache: questions whose normalized embeddings are at least
+# this similar to a previously answered one reuse its (answer, sources).
+CACHE_MAX_ENTRIES = 512
+CACHE_SIMILARITY = 0.97
+
+# Async retrievals arriving within this window share one encode call
+BATCH_MAX_QUERIES = 16
+BATCH_WINDOW_SECONDS = 0.005
+
+# (query_embedding, cached, contexts, sources), see RAGPipeline.retrieve_batch
+Retrieval = tuple[np.ndarray, tuple[str, list[Source]] | None, list[dict], list[Source]]
+
 
 class RAGPipeline:
     def __init__(self):
-        self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
-        self.collection = get_chroma_collection()
+        self.embedder = get_embedder()
+        self.embeddings, self.chunks = load_search_index()
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not set in environment")
         self.client = genai.Client(api_key=api_key)
+        # Async view of the same client, sharing its connection pool
+        self.aclient = self.client.aio
 
-    def retrieve(self, query: str, top_k: int = 6) -> list[dict]:
-        """Embed query, search ChromaDB, deduplicate by URL."""
-        query_embedding = self.embedder.encode(query).tolist()
+        # LRU cache of answered questions, slot i of the matrix <-> entry i
+        self._cache_vecs = np.zeros((CACHE_MAX_ENTRIES, EMBED_DIM), dtype=np.float32)
+        self._cache_entries: list[tuple[str, list[Source]]] = []
+        self._cache_last_used = np.zeros(CACHE_MAX_ENTRIES, dtype=np.int64)
+        self._cache_clock = 0
+        self._cache_lock = threading.Lock()
 
-        # Fetch more than needed so we can deduplicate
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(top_k * 3, 20),
-            include=["documents", "metadatas", "distances"],
-        )
+        # Started lazily, since it needs the server's running event loop
+        self._retrieve_queue: asyncio.Queue | None = None
+        self._retrieve_batcher: asyncio.Task | None = None
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a query as a unit-length float32 vector."""
+        return self.embedder.encode(query, normalize_embeddings=True).astype(np.float32)
+
+    def retrieve(
+        self, query: str, top_k: int = 6, query_embedding: np.ndarray | None = None
+    ) -> tuple[list[dict], list[Source]]:
+        """Embed query, rank all chunks by cosine similarity, deduplicate by URL.
+
+        Returns (contexts, sources): the chunks for the prompt, and one Source
+        per page with a quote for each of its chunks.
+        """
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+
+        # Rows and query are normalized, so one matrix-vector product scores all
+        return self._select(self.embeddings @ query_embedding, top_k)
+
+    def retrieve_batch(
+        self,
+        queries: list[str],
+        top_ks: list[int],
+        chat_histories: list[list[dict] | None],
+    ) -> list[Retrieval]:
+        """Embed several queries at once and search those the cache can't answer.
+
+        Returns (query_embedding, cached, contexts, sources) per query, in
+        input order. On a cache hit, cached is the (answer, sources) pair and
+        the query is not searched, so contexts and sources are empty.
+        """
+        query_embeddings = self.embedder.encode(
+            queries, normalize_embeddings=True
+        ).astype(np.float32)
+        cached = [
+            self._cache_lookup(query_embedding, chat_history)
+            for query_embedding, chat_history in zip(query_embeddings, chat_histories)
+        ]
+
+        results = [(emb, hit, [], []) for emb, hit in zip(query_embeddings, cached)]
+        misses = [j for j, hit in enumerate(cached) if hit is None]
+        if misses:
+            sims = self.embeddings @ query_embeddings[misses].T
+            for col, j in enumerate(misses):
+                contexts, sources = self._select(sims[:, col], top_ks[j])
+                results[j] = (query_embeddings[j], None, contexts, sources)
+        return results
+
+    async def aretrieve(
+        self, query: str, top_k: int = 6, chat_history: list[dict] | None = None
+    ) -> Retrieval:
+        """Async cache lookup and retrieve, micro-batched with concurrent callers.
+
+        Returns (query_embedding, cached, contexts, sources), as retrieve_batch.
+        """
+        if self._retrieve_batcher is None:
+            self._retrieve_queue = asyncio.Queue()
+            self._retrieve_batcher = asyncio.create_task(self._retrieve_loop())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._retrieve_queue.put((query, top_k, chat_history, future))
+        return await future
+
+    async def _retrieve_loop(self) -> None:
+        """Drain queued retrievals in batches, one encode call per batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._retrieve_queue.get()]
+            deadline = loop.time() + BATCH_WINDOW_SECONDS
+            while len(batch) < BATCH_MAX_QUERIES:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._retrieve_queue.get(), timeout)
+                    )
+                except TimeoutError:
+                    break
+
+            queries, top_ks, chat_histories, futures = zip(*batch)
+            try:
+                results = await asyncio.to_thread(
+                    self.retrieve_batch,
+                    list(queries),
+                    list(top_ks),
+                    list(chat_histories),
+                )
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
 
-        if not results["ids"][0]:
-            return []
+            for future, result in zip(futures, results):
+                # The caller may have gone away while we were encoding
+                if not future.done():
+                    future.set_result(result)
 
-        # Deduplicate: max 2 chunks per page
-        url_counts: dict[str, int] = defaultdict(int)
-        deduped = []
+    async def aclose(self) -> None:
+        """Stop the background retrieval batcher."""
+        if self._retrieve_batcher is not None:
+            self._retrieve_batcher.cancel()
+            try:
+                await self._retrieve_batcher
+            except asyncio.CancelledError:
+                pass
+            self._retrieve_batcher = None
 
-        for i, doc_id in enumerate(results["ids"][0]):
-            metadata = results["metadatas"][0][i]
+    def _select(
+        self, sims: np.ndarray, top_k: int
+    ) -> tuple[list[dict], list[Source]]:
+        """Take the best-scoring chunks, at most 2 per page, and their sources."""
+        # Fetch more than needed so we can deduplicate
+        n_results = min(top_k * 3, 20, len(self.chunks))
+        if n_results == 0:
+            return [], []
+        top = np.argpartition(-sims, n_results - 1)[:n_results]
+        top = top[np.argsort(-sims[top])]
+
+        contexts = []
+        sources: dict[str, Source] = {}  # by URL, in rank order
+
+        for row in top:
+            chunk = self.chunks[row]
+            metadata = chunk["metadata"]
             url = metadata["url"]
 
-            if url_counts[url] >= 2:
+            # Deduplicate: max 2 chunks per page
+            source = sources.get(url)
+            if source is not None and len(source.quotes) >= 2:
                 continue
-            url_counts[url] += 1
 
-            deduped.append(
+            contexts.append(
                 {
-                    "id": doc_id,
-                    "text": results["documents"][0][i],
+                    "id": chunk["id"],
+                    "text": chunk["text"],
                     "metadata": metadata,
-                    "distance": results["distances"][0][i],
+                    "distance": 1.0 - float(sims[row]),
                 }
             )
 
-            if len(deduped) >= top_k:
+            # Strip prepended title from chunk text to get raw quote
+            raw = chunk["text"].removeprefix(metadata["title"] + "\n\n")
+            quote = raw.strip()
+            if source is not None:
+                source.quotes.append(quote)
+            else:
+                snippet = raw[:200].strip()
+                if len(raw) > 200:
+                    snippet += "..."
+                # Internally generated strings, so skip validation
+                sources[url] = Source.model_construct(
+                    url=url,
+                    title=metadata["title"],
+                    category=metadata["category"],
+                    snippet=snippet,
+                    quotes=[quote],
+                )
+
+            if len(contexts) >= top_k:
                 break
 
-        return deduped
+        return contexts, list(sources.values())
 
-    def generate(
+    def _build_contents(
         self,
         question: str,
         contexts: list[dict],
         chat_history: list[dict] | None = None,
-    ) -> str:
-        """Construct prompt with context and history, call Gemini."""
+    ) -> list[genai.types.ContentDict]:
+        """Construct the Gemini conversation: history plus question with context."""
         # Build context block
         context_parts = []
         for i, ctx in enumerate(contexts, 1):
@@ -88,88 +246,186 @@ class RAGPipeline:
             )
         context_block = "\n---\n".join(context_parts)
 
-        # Build conversation history
-        contents = []
-        if chat_history:
-            for msg in chat_history[-6:]:  # Keep last 6 messages for context
-                role = "user" if msg.get("role") == "user" else "model"
-                contents.append(
-                    genai.types.Content(
-                        role=role,
-                        parts=[genai.types.Part(text=msg["content"])],
-                    )
-                )
+        # Build conversation history as plain dicts, which the SDK accepts
+        # without constructing Content/Part models per message
+        contents = [
+            {
+                "role": "user" if msg.get("role") == "user" else "model",
+                "parts": [{"text": msg["content"]}],
+            }
+            for msg in (chat_history or [])[-6:]  # Keep last 6 messages for context
+        ]
 
         # Add current question with context
         user_message = (
             f"Context from urbanemissions.info:\n\n{context_block}\n\n"
             f"Question: {question}"
         )
-        contents.append(
-            genai.types.Content(
-                role="user",
-                parts=[genai.types.Part(text=user_message)],
-            )
+        contents.append({"role": "user", "parts": [{"text": user_message}]})
+        return contents
+
+    def _generate_config(self) -> genai.types.GenerateContentConfig:
+        """Generation settings shared by the sync and async paths."""
+        return genai.types.GenerateContentConfig(
+            system_instruction=SYSTEM_PROMPT,
+            temperature=0.3,
+            max_output_tokens=4096,
         )
 
+    def generate(
+        self,
+        question: str,
+        contexts: list[dict],
+        chat_history: list[dict] | None = None,
+    ) -> str:
+        """Construct prompt with context and history, call Gemini."""
         response = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=contents,
-            config=genai.types.GenerateContentConfig(
-                system_instruction=SYSTEM_PROMPT,
-                temperature=0.3,
-                max_output_tokens=4096,
-            ),
+            model=GEMINI_MODEL,
+            contents=self._build_contents(question, contexts, chat_history),
+            config=self._generate_config(),
         )
+        return response.text or NO_ANSWER
 
-        return response.text
+    async def agenerate(
+        self,
+        question: str,
+        contexts: list[dict],
+        chat_history: list[dict] | None = None,
+    ) -> str:
+        """Async version of generate using the async Gemini client."""
+        response = await self.aclient.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=self._build_contents(question, contexts, chat_history),
+            config=self._generate_config(),
+        )
+        return response.text or NO_ANSWER
 
     def query(
         self, question: str, chat_history: list[dict] | None = None
     ) -> tuple[str, list[Source]]:
         """Full RAG pipeline: retrieve + generate. Returns (answer, sources)."""
-        contexts = self.retrieve(question)
+        query_embedding = self.embed_query(question)
+        cached = self._cache_lookup(query_embedding, chat_history)
+        if cached is not None:
+            return cached
 
+        contexts, sources = self.retrieve(question, query_embedding=query_embedding)
         if not contexts:
-            return (
-                "I couldn't find any relevant information from urbanemissions.info for this question.",
-                [],
-            )
+            return NO_CONTEXT_ANSWER, []
 
         answer = self.generate(question, contexts, chat_history)
+        self._cache_store(query_embedding, chat_history, answer, sources)
+        return answer, sources
 
-        sources = []
-        seen_urls: dict[str, int] = {}
-        for ctx in contexts:
-            url = ctx["metadata"]["url"]
-            title = ctx["metadata"]["title"]
-            # Strip prepended title from chunk text to get raw quote
-            raw = ctx["text"]
-            if raw.startswith(title + "\n\n"):
-                raw = raw[len(title) + 2:]
-            quote = raw.strip()
-
-            if url in seen_urls:
-                # Append quote to existing source
-                idx = seen_urls[url]
-                sources[idx].quotes.append(quote)
-            else:
-                seen_urls[url] = len(sources)
-                snippet = raw[:200].strip()
-                if len(raw) > 200:
-                    snippet += "..."
-                sources.append(
-                    Source(
-                        url=url,
-                        title=title,
-                        category=ctx["metadata"]["category"],
-                        snippet=snippet,
-                        quotes=[quote],
-                    )
-                )
+    async def aquery(
+        self, question: str, chat_history: list[dict] | None = None
+    ) -> tuple[str, list[Source]]:
+        """Async version of query that keeps the event loop free."""
+        query_embedding, cached, contexts, sources = await self.aretrieve(
+            question, chat_history=chat_history
+        )
+        if cached is not None:
+            return cached
+        if not contexts:
+            return NO_CONTEXT_ANSWER, []
 
+        answer = await self.agenerate(question, contexts, chat_history)
+        self._cache_store(query_embedding, chat_history, answer, sources)
         return answer, sources
 
+    async def astream(
+        self, question: str, chat_history: list[dict] | None = None
+    ) -> AsyncIterator[dict]:
+        """Stream the answer as {"text": ...} events, then one {"sources": [...]}."""
+        query_embedding, cached, contexts, sources = await self.aretrieve(
+            question, chat_history=chat_history
+        )
+        if cached is not None:
+            answer, sources = cached
+            yield {"text": answer}
+            yield {"sources": sources}
+            return
+        if not contexts:
+            yield {"text": NO_CONTEXT_ANSWER}
+            yield {"sources": []}
+            return
+
+        parts = []
+        stream = await self.aclient.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=self._build_contents(question, contexts, chat_history),
+            config=self._generate_config(),
+        )
+        async for chunk in stream:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield {"text": chunk.text}
+        if not parts:
+            yield {"text": NO_ANSWER}
+
+        # Only reached if the client stayed until the end, so the answer is whole
+        self._cache_store(query_embedding, chat_history, "".join(parts), sources)
+        yield {"sources": sources}
+
+    def _cache_lookup(
+        self, query_embedding: np.ndarray, chat_history: list[dict] | None = None
+    ) -> tuple[str, list[Source]] | None:
+        """Return the cached answer for a near-duplicate question, if any.
+
+        Follow-ups depend on the conversation, so only standalone questions
+        (no chat history) go through the semantic cache.
+        """
+        if chat_history:
+            return None
+        with self._cache_lock:
+            slot = self._cache_match(query_embedding)
+            if slot is None:
+                return None
+
+            self._cache_clock += 1
+            self._cache_last_used[slot] = self._cache_clock
+            return self._cache_entries[slot]
+
+    def _cache_store(
+        self,
+        query_embedding: np.ndarray,
+        chat_history: list[dict] | None,
+        answer: str,
+        sources: list[Source],
+    ) -> None:
+        """Add a standalone question's answer to the cache, evicting the least
+        recently used entry."""
+        # An empty answer (blocked or cut-off response) would otherwise be
+        # replayed to every similar question until evicted
+        if chat_history or not answer or answer == NO_ANSWER:
+            return
+        with self._cache_lock:
+            # Concurrent requests for the same question all miss, then all
+            # store; keep the first answer rather than a slot per request
+            slot = self._cache_match(query_embedding)
+            if slot is None:
+                if len(self._cache_entries) < CACHE_MAX_ENTRIES:
+                    slot = len(self._cache_entries)
+                    self._cache_entries.append((answer, sources))
+                else:
+                    slot = int(np.argmin(self._cache_last_used))
+                    self._cache_entries[slot] = (answer, sources)
+                self._cache_vecs[slot] = query_embedding
+
+            self._cache_clock += 1
+            self._cache_last_used[slot] = self._cache_clock
+
+    def _cache_match(self, query_embedding: np.ndarray) -> int | None:
+        """Slot of a cached near-duplicate question. Call with _cache_lock held."""
+        n = len(self._cache_entries)
+        if n == 0:
+            return None
+
+        # Embeddings are normalized, so the dot product is cosine similarity
+        sims = self._cache_vecs[:n] @ query_embedding
+        best = int(np.argmax(sims))
+        return best if sims[best] >= CACHE_SIMILARITY else None
+
     def chunk_count(self) -> int:
-        """Return total chunks in the collection."""
-        return self.collection.count()
+        """Return total chunks in the search matrix."""
+        return len(self.chunks)
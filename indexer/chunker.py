@@ -2,17 +2,56 @@
 
 import re
 
+import numpy as np
+from numba import njit
+
+from scraper.common import url_to_slug
+
+# Chunk break points: just past sentence-ending punctuation or a blank line
+BOUNDARY_RE = re.compile(r"[.!?]\s+|\n\s*\n\s*")
+
+
+@njit(cache=True)
+def _chunk_spans(
+    bounds: np.ndarray, text_len: int, chunk_size: int, overlap: int
+) -> np.ndarray:
+    """Compute (start, end) offsets of overlapping chunks.
+
+    bounds holds the sorted offsets where a chunk may end. Each chunk ends at
+    the last boundary that fits in chunk_size and lies past the previous
+    chunk's end (or is hard split if there is none), and the next starts at
+    the first boundary inside the overlap.
+    """
+    starts = []
+    ends = []
+    n_bounds = bounds.shape[0]
+    start = 0
+    prev_end = 0
+    while start < text_len:
+        limit = start + chunk_size
+        if limit >= text_len:
+            end = text_len
+        else:
+            i = np.searchsorted(bounds, limit, side="right") - 1
+            # A boundary at or before prev_end would give a chunk that sits
+            # inside the previous one
+            end = bounds[i] if i >= 0 and bounds[i] > max(start, prev_end) else limit
 
-def url_to_slug(url: str) -> str:
-    """Convert URL to a short slug for chunk IDs."""
-    slug = url.replace("https://", "").replace("http://", "")
-    slug = re.sub(r"[^a-zA-Z0-9]", "_", slug)
-    return slug.strip("_")
+        starts.append(start)
+        ends.append(end)
+        if end >= text_len:
+            break
+        prev_end = end
 
+        target = max(end - overlap, start + 1)
+        j = np.searchsorted(bounds, target)
+        start = bounds[j] if j < n_bounds and bounds[j] < end else target
 
-def split_into_sentences(text: str) -> list[str]:
-    """Split text into sentences."""
-    return re.split(r"(?<=[.!?])\s+", text)
+    spans = np.empty((len(starts), 2), dtype=np.int64)
+    for k in range(len(starts)):
+        spans[k, 0] = starts[k]
+        spans[k, 1] = ends[k]
+    return spans
 
 
 def chunk_text(
@@ -23,52 +62,16 @@ def chunk_text(
     min_chunk_size: int = 100,
 ) -> list[str]:
     """Split text into overlapping chunks, respecting paragraph/sentence boundaries."""
-    # Split into paragraphs first
-    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-
-    chunks = []
-    current = ""
-
-    for para in paragraphs:
-        # If adding this paragraph exceeds chunk_size, finalize current chunk
-        if current and len(current) + len(para) + 2 > chunk_size:
-            chunks.append(current)
-            # Start new chunk with overlap from end of previous
-            if len(current) > overlap:
-                # Find a sentence boundary near the overlap point
-                overlap_text = current[-(overlap):]
-                sentences = split_into_sentences(overlap_text)
-                if len(sentences) > 1:
-                    current = " ".join(sentences[1:]) + "\n\n" + para
-                else:
-                    current = overlap_text + "\n\n" + para
-            else:
-                current = current + "\n\n" + para
-        else:
-            current = (current + "\n\n" + para).strip() if current else para
-
-        # If a single paragraph is very long, force split it
-        while len(current) > chunk_size * 1.5:
-            # Split at sentence boundary near chunk_size
-            sentences = split_into_sentences(current)
-            chunk = ""
-            remaining_sentences = []
-            for i, sent in enumerate(sentences):
-                if len(chunk) + len(sent) + 1 > chunk_size and chunk:
-                    remaining_sentences = sentences[i:]
-                    break
-                chunk = (chunk + " " + sent).strip() if chunk else sent
-            else:
-                # Couldn't split by sentences, hard split
-                chunks.append(current[:chunk_size])
-                current = current[chunk_size - overlap :]
-                continue
-
-            chunks.append(chunk)
-            current = " ".join(remaining_sentences)
-
-    if current:
-        chunks.append(current)
+    text = text.strip()
+    if not text:
+        return []
+
+    # Offsets where a chunk may end, found in one pass over the text
+    bounds = np.array(
+        [m.end() for m in BOUNDARY_RE.finditer(text)], dtype=np.int64
+    )
+    spans = _chunk_spans(bounds, len(text), chunk_size, overlap)
+    chunks = [text[start:end] for start, end in spans.tolist()]
 
     # Prepend title and filter short chunks
     result = []
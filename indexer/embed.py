@@ -1,14 +1,93 @@
-"""Embedding generation and ChromaDB upsert."""
+"""Embedding generation, ChromaDB upsert, and the retrieval matrix."""
 
+import functools
+import hashlib
 from pathlib import Path
 
 import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
 
 CHROMA_DIR = Path("chroma_db")
 COLLECTION_NAME = "urbanemissions"
 MODEL_NAME = "all-MiniLM-L6-v2"
-BATCH_SIZE = 100
+HF_MODEL_ID = f"sentence-transformers/{MODEL_NAME}"
+ONNX_DIR = Path("onnx")
+ONNX_FILE = "model_quantized.onnx"
+EMBEDDER_ID = f"{MODEL_NAME}-onnx-int8"  # tags cached vectors
+EMBED_DIM = 384
+MAX_SEQ_LENGTH = 256  # same truncation as the sentence-transformers model
+EMBEDDINGS_PATH = CHROMA_DIR / "emb.fp16"
+META_PATH = CHROMA_DIR / "meta.parquet"
+ENCODE_BATCH_SIZE = 256
+BATCH_SIZE = 250  # rows per ChromaDB upsert
+EMBED_CACHE_PATH = Path("data/embed_cache.npz")
+
+
+def export_onnx_model(model_dir: Path = ONNX_DIR) -> None:
+    """Export MiniLM to ONNX and quantize its weights to int8 (dynamic)."""
+    print(f"Exporting {HF_MODEL_ID} to int8 ONNX in {model_dir}/...")
+    model = ORTModelForFeatureExtraction.from_pretrained(HF_MODEL_ID, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=model_dir, quantization_config=qconfig)
+    AutoTokenizer.from_pretrained(HF_MODEL_ID).save_pretrained(model_dir)
+
+
+class OnnxEmbedder:
+    """int8 ONNX Runtime MiniLM with a SentenceTransformer-style encode()."""
+
+    def __init__(self, model_dir: Path = ONNX_DIR):
+        if not (model_dir / ONNX_FILE).exists():
+            export_onnx_model(model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name=ONNX_FILE
+        )
+
+    def encode(
+        self,
+        sentences: str | list[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+    ) -> np.ndarray:
+        """Mean-pooled float32 embeddings, one row per sentence."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = np.empty((len(sentences), EMBED_DIM), dtype=np.float32)
+        for i in range(0, len(sentences), batch_size):
+            batch = sentences[i : i + batch_size]
+            inputs = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np",
+            )
+            hidden = self.model(**inputs).last_hidden_state
+            # Average token vectors, ignoring padding
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            summed = (hidden * mask).sum(axis=1)
+            embeddings[i : i + len(batch)] = summed / np.maximum(mask.sum(axis=1), 1e-9)
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+
+        return embeddings[0] if single else embeddings
+
+
+@functools.lru_cache(maxsize=1)
+def get_embedder() -> OnnxEmbedder:
+    """Process-wide embedder, loaded on first use."""
+    print(f"Loading embedding model: {EMBEDDER_ID}...")
+    return OnnxEmbedder()
 
 
 def get_chroma_collection() -> chromadb.Collection:
@@ -21,36 +100,155 @@ def get_chroma_collection() -> chromadb.Collection:
     return collection
 
 
+def build_search_index(chunks: list[dict], embeddings: np.ndarray) -> None:
+    """Write the fp16 embedding matrix and its row-aligned chunk table."""
+    matrix = np.memmap(
+        EMBEDDINGS_PATH, dtype=np.float16, mode="w+", shape=(len(chunks), EMBED_DIM)
+    )
+    matrix[:] = embeddings
+    matrix.flush()
+
+    # Row i of the table is row i of the matrix. The schema records which
+    # embedder wrote the rows, since queries must be encoded by the same one.
+    table = pa.Table.from_pylist(chunks)
+    table = table.replace_schema_metadata({"embedder": EMBEDDER_ID})
+    pq.write_table(table, META_PATH)
+
+
+def search_index_embedder() -> str | None:
+    """Embedder that wrote the persisted search index, or None if there is none."""
+    if not (META_PATH.exists() and EMBEDDINGS_PATH.exists()):
+        return None
+    metadata = pq.read_schema(META_PATH).metadata or {}
+    embedder = metadata.get(b"embedder")
+    return embedder.decode() if embedder else None
+
+
+def build_search_index_from_chroma() -> None:
+    """Write the search index from the chunks stored in ChromaDB.
+
+    The documents are re-encoded rather than reusing the collection's vectors,
+    which may come from a different embedder.
+    """
+    print("Search index missing or stale, building it from ChromaDB...")
+    data = get_chroma_collection().get(include=["documents", "metadatas"])
+    if not data["ids"]:
+        raise FileNotFoundError(
+            f"No search index or ChromaDB collection in {CHROMA_DIR}; "
+            "run the indexer first"
+        )
+
+    chunks = [
+        {"id": chunk_id, "text": text, "metadata": metadata}
+        for chunk_id, text, metadata in zip(
+            data["ids"], data["documents"], data["metadatas"]
+        )
+    ]
+    embeddings = get_embedder().encode(
+        data["documents"], batch_size=ENCODE_BATCH_SIZE, normalize_embeddings=True
+    )
+    build_search_index(chunks, embeddings)
+
+
+def load_search_index() -> tuple[np.ndarray, list[dict]]:
+    """Load the normalized embedding matrix and the chunk rows it indexes.
+
+    Builds the index from ChromaDB first if its files are missing (e.g. in a
+    checkout that only has the collection) or were written by another embedder.
+    """
+    if search_index_embedder() != EMBEDDER_ID:
+        build_search_index_from_chroma()
+
+    chunks = pq.read_table(META_PATH).to_pylist()
+    matrix = np.memmap(
+        EMBEDDINGS_PATH, dtype=np.float16, mode="r", shape=(len(chunks), EMBED_DIM)
+    )
+    # numpy has no BLAS path for fp16, so search in fp32
+    return np.asarray(matrix, dtype=np.float32), chunks
+
+
+def text_hash(text: str) -> bytes:
+    """Content key for the embedding cache."""
+    return hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+
+def load_embed_cache() -> dict[bytes, np.ndarray]:
+    """Load cached embeddings keyed by text hash. Empty if missing or stale."""
+    if not EMBED_CACHE_PATH.exists():
+        return {}
+    with np.load(EMBED_CACHE_PATH) as data:
+        if str(data["model"]) != EMBEDDER_ID:
+            return {}
+        keys = data["keys"]
+        vectors = data["vectors"]
+    return {key.tobytes(): vec for key, vec in zip(keys, vectors)}
+
+
+def save_embed_cache(cache: dict[bytes, np.ndarray]) -> None:
+    """Persist the embedding cache."""
+    EMBED_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    keys = np.frombuffer(b"".join(cache), dtype=np.uint8).reshape(-1, 16)
+    vectors = np.array(list(cache.values()), dtype=np.float32)
+    np.savez(EMBED_CACHE_PATH, model=np.array(EMBEDDER_ID), keys=keys, vectors=vectors)
+
+
 def embed_and_store(chunks: list[dict]) -> int:
     """Embed all chunks and upsert into ChromaDB. Returns number of chunks stored."""
     CHROMA_DIR.mkdir(parents=True, exist_ok=True)
 
-    print(f"Loading embedding model: {MODEL_NAME}...")
-    model = SentenceTransformer(MODEL_NAME)
+    texts = [c["text"] for c in chunks]
+    hashes = [text_hash(t) for t in texts]
+    cache = load_embed_cache()
+    # Encode shortest first so each batch holds similar lengths and pads little.
+    # Results are keyed back by index, so upsert order is unaffected.
+    to_encode = sorted(
+        (i for i, h in enumerate(hashes) if h not in cache), key=lambda i: len(texts[i])
+    )
+    print(f"Embedding cache: {len(texts) - len(to_encode)} hits, {len(to_encode)} to encode")
 
-    collection = get_chroma_collection()
+    if to_encode:
+        model = get_embedder()
 
-    print(f"Embedding and upserting {len(chunks)} chunks...")
+        print(f"Embedding {len(to_encode)} chunks...")
+        encoded = model.encode(
+            [texts[i] for i in to_encode],
+            batch_size=ENCODE_BATCH_SIZE,
+            normalize_embeddings=True,
+        )
+        for i, vec in zip(to_encode, encoded):
+            cache[hashes[i]] = vec
 
-    for i in range(0, len(chunks), BATCH_SIZE):
-        batch = chunks[i : i + BATCH_SIZE]
+    embeddings = np.array([cache[h] for h in hashes], dtype=np.float32)
+    # Only keep entries for the current chunks so the cache doesn't grow forever
+    save_embed_cache({h: cache[h] for h in hashes})
 
-        ids = [c["id"] for c in batch]
-        texts = [c["text"] for c in batch]
-        metadatas = [c["metadata"] for c in batch]
+    print("Writing search matrix...")
+    build_search_index(chunks, embeddings)
 
-        embeddings = model.encode(texts, show_progress_bar=False).tolist()
+    collection = get_chroma_collection()
+
+    print(f"Upserting {len(chunks)} chunks...")
+    for i in range(0, len(chunks), BATCH_SIZE):
+        batch = chunks[i : i + BATCH_SIZE]
 
         collection.upsert(
-            ids=ids,
-            documents=texts,
-            embeddings=embeddings,
-            metadatas=metadatas,
+            ids=[c["id"] for c in batch],
+            documents=texts[i : i + BATCH_SIZE],
+            embeddings=embeddings[i : i + BATCH_SIZE].tolist(),
+            metadatas=[c["metadata"] for c in batch],
         )
 
         done = min(i + BATCH_SIZE, len(chunks))
         print(f"  Upserted: {done}/{len(chunks)}")
 
+    # Upserts never remove anything, so drop chunks the chunker no longer makes
+    current = {c["id"] for c in chunks}
+    stale = [i for i in collection.get(include=[])["ids"] if i not in current]
+    if stale:
+        print(f"Deleting {len(stale)} stale chunks...")
+        for i in range(0, len(stale), BATCH_SIZE):
+            collection.delete(ids=stale[i : i + BATCH_SIZE])
+
     total = collection.count()
     print(f"Collection now has {total} chunks")
     return total
@@ -0,0 +1,19 @@
+"""URL helpers shared by the crawler, extractor, and chunker."""
+
+import re
+from urllib.parse import urlsplit
+
+_SLUG_RE = re.compile(r"[^a-zA-Z0-9]")
+
+
+def url_to_slug(url: str) -> str:
+    """Convert URL to a filesystem-safe slug, also used in chunk IDs."""
+    return _SLUG_RE.sub("_", url.split("://", 1)[-1]).strip("_")
+
+
+def category_from_url(url: str) -> str:
+    """Derive category from the first URL path segment."""
+    segment = urlsplit(url).path.strip("/").split("/", 1)[0]
+    if segment:
+        return segment.replace("-", " ").title()
+    return "General"
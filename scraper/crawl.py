@@ -1,23 +1,16 @@
 """Sitemap parser and async page downloader for urbanemissions.info."""
 
 import asyncio
-import re
 from pathlib import Path
 from xml.etree import ElementTree
 
 import httpx
 
+from scraper.common import url_to_slug
+
 DATA_DIR = Path("data/raw_html")
 SITEMAP_URL = "https://urbanemissions.info/page-sitemap.xml"
 CONCURRENCY = 5
-DELAY_BETWEEN_BATCHES = 1.0
-
-
-def url_to_slug(url: str) -> str:
-    """Convert URL to filesystem-safe slug."""
-    slug = url.replace("https://", "").replace("http://", "")
-    slug = re.sub(r"[^a-zA-Z0-9]", "_", slug)
-    return slug.strip("_")
 
 
 def parse_sitemap(xml_text: str) -> list[str]:
@@ -54,7 +47,14 @@ async def crawl() -> list[str]:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
     async with httpx.AsyncClient(
-        headers={"User-Agent": "urbanemissions-rag-bot/0.1 (research)"}
+        http2=True,
+        headers={
+            "User-Agent": "urbanemissions-rag-bot/0.1 (research)",
+            "Accept-Encoding": "br, gzip",
+        },
+        limits=httpx.Limits(
+            max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY
+        ),
     ) as client:
         # Fetch sitemap
         print("Fetching sitemap...")
@@ -63,29 +63,21 @@ async def crawl() -> list[str]:
         urls = parse_sitemap(resp.text)
         print(f"Found {len(urls)} pages in sitemap")
 
-        # Download pages in batches
+        # The semaphore keeps at most CONCURRENCY requests in flight
         semaphore = asyncio.Semaphore(CONCURRENCY)
         downloaded = []
         failed = []
 
-        # Process in batches for polite crawling
-        batch_size = CONCURRENCY
-        for i in range(0, len(urls), batch_size):
-            batch = urls[i : i + batch_size]
-            tasks = [download_page(client, url, semaphore) for url in batch]
-            results = await asyncio.gather(*tasks)
-
-            for url, success in results:
-                if success:
-                    downloaded.append(url)
-                else:
-                    failed.append(url)
-
-            done = min(i + batch_size, len(urls))
-            print(f"  Progress: {done}/{len(urls)} pages")
+        tasks = [download_page(client, url, semaphore) for url in urls]
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            url, success = await task
+            if success:
+                downloaded.append(url)
+            else:
+                failed.append(url)
 
-            if i + batch_size < len(urls):
-                await asyncio.sleep(DELAY_BETWEEN_BATCHES)
+            if done % CONCURRENCY == 0 or done == len(urls):
+                print(f"  Progress: {done}/{len(urls)} pages")
 
         print(f"Downloaded: {len(downloaded)}, Failed: {len(failed)}")
         return downloaded
@@ -1,53 +1,55 @@
 """HTML to clean text + metadata extraction."""
 
-import json
-import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from bs4 import BeautifulSoup
+import pyarrow as pa
+import pyarrow.parquet as pq
+from selectolax.lexbor import LexborHTMLParser
 
-RAW_DIR = Path("data/raw_html")
-EXTRACTED_DIR = Path("data/extracted")
+from scraper.common import category_from_url
 
+RAW_DIR = Path("data/raw_html")
+EXTRACTED_PATH = Path("data/extracted.parquet")
 
-def category_from_url(url: str) -> str:
-    """Derive category from URL path."""
-    path = url.rstrip("/").split("//")[-1]
-    parts = path.split("/")
-    if len(parts) >= 2:
-        cat = parts[1]
-        return cat.replace("-", " ").title()
-    return "General"
+# Main content containers, in order of preference
+CONTENT_SELECTORS = ["article", ".entry-content", "main", "#content"]
+NOISE_SELECTOR = "script, style, nav, footer, aside"
+TEXT_SELECTOR = "p, h2, h3, h4, li, td, blockquote"
 
 
 def extract_page(html: str, url: str) -> dict | None:
     """Extract clean text and metadata from HTML."""
-    soup = BeautifulSoup(html, "lxml")
+    return extract_tree(LexborHTMLParser(html), url)
+
 
+def extract_tree(tree: LexborHTMLParser, url: str) -> dict | None:
+    """Extract clean text and metadata from an already parsed page."""
     # Extract title before removing elements
-    title_tag = soup.find("h1") or soup.find("title")
-    title = title_tag.get_text(strip=True) if title_tag else ""
+    title_tag = tree.css_first("h1") or tree.css_first("title")
+    title = title_tag.text(strip=True) if title_tag else ""
 
     # Find main content before removing noise
-    content_el = (
-        soup.find("article")
-        or soup.find(class_="entry-content")
-        or soup.find("main")
-        or soup.find(id="content")
-        or soup.body
-    )
+    content_el = None
+    for selector in CONTENT_SELECTORS:
+        content_el = tree.css_first(selector)
+        if content_el:
+            break
+    else:
+        content_el = tree.body
 
     if not content_el:
         return None
 
     # Remove noise elements within content
-    for tag in content_el.find_all(["script", "style", "nav", "footer", "aside"]):
-        tag.decompose()
+    for node in content_el.css(NOISE_SELECTOR):
+        node.decompose()
 
     # Extract text, preserving paragraph structure
     paragraphs = []
-    for el in content_el.find_all(["p", "h2", "h3", "h4", "li", "td", "blockquote"]):
-        text = el.get_text(separator=" ", strip=True)
+    for el in content_el.css(TEXT_SELECTOR):
+        # Collapse whitespace runs, including &nbsp;-only fragments
+        text = " ".join(el.text(separator=" ").split())
         if text and len(text) > 10:
             paragraphs.append(text)
 
@@ -58,8 +60,8 @@ def extract_page(html: str, url: str) -> dict | None:
 
     # Extract PDF links
     pdf_links = []
-    for a in content_el.find_all("a", href=True):
-        href = a["href"]
+    for a in content_el.css("a[href]"):
+        href = a.attributes.get("href") or ""
         if href.lower().endswith(".pdf"):
             pdf_links.append(href)
 
@@ -72,42 +74,42 @@ def extract_page(html: str, url: str) -> dict | None:
     }
 
 
+def _process_file(html_path: Path) -> dict | None:
+    """Extract one downloaded page. Runs in a worker process."""
+    html = html_path.read_text(encoding="utf-8", errors="replace")
+    tree = LexborHTMLParser(html)
+
+    # Reconstruct URL from slug (approximate -- stored in the HTML meta)
+    canonical = tree.css_first('link[rel="canonical"]')
+    href = canonical.attributes.get("href") if canonical else None
+    url = href or html_path.stem.replace("_", "/")
+
+    return extract_tree(tree, url)
+
+
 def extract_all() -> list[dict]:
-    """Extract text from all downloaded HTML files."""
-    EXTRACTED_DIR.mkdir(parents=True, exist_ok=True)
-    results = []
+    """Extract text from all downloaded HTML files into one parquet table."""
+    EXTRACTED_PATH.parent.mkdir(parents=True, exist_ok=True)
 
     html_files = sorted(RAW_DIR.glob("*.html"))
     print(f"Extracting text from {len(html_files)} HTML files...")
 
-    for html_path in html_files:
-        html = html_path.read_text(encoding="utf-8", errors="replace")
+    # Parsing is CPU-bound, so spread files across processes
+    with ProcessPoolExecutor() as executor:
+        results = [
+            r for r in executor.map(_process_file, html_files, chunksize=8) if r
+        ]
 
-        # Reconstruct URL from slug (approximate -- stored in the HTML meta)
-        soup = BeautifulSoup(html, "lxml")
-        canonical = soup.find("link", rel="canonical")
-        url = canonical["href"] if canonical and canonical.get("href") else html_path.stem.replace("_", "/")
-
-        result = extract_page(html, url)
-        if result:
-            # Save individual JSON
-            slug = html_path.stem
-            out_path = EXTRACTED_DIR / f"{slug}.json"
-            out_path.write_text(json.dumps(result, ensure_ascii=False, indent=2))
-            results.append(result)
+    # One row per page; pdf_links is stored as a list column
+    pq.write_table(pa.Table.from_pylist(results), EXTRACTED_PATH, compression="zstd")
 
     print(f"Extracted {len(results)} pages with content")
     return results
 
 
 def load_extracted() -> list[dict]:
-    """Load all previously extracted JSON files."""
-    files = sorted(EXTRACTED_DIR.glob("*.json"))
-    results = []
-    for f in files:
-        data = json.loads(f.read_text())
-        results.append(data)
-    return results
+    """Load previously extracted pages."""
+    return pq.read_table(EXTRACTED_PATH).to_pylist()
 
 
 if __name__ == "__main__":
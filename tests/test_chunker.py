@@ -0,0 +1,29 @@
+"""Tests for the text chunker."""
+
+from indexer.chunker import chunk_text
+
+
+def test_no_chunk_contained_in_previous():
+    text = ("Short sentence number %d. " * 30) % tuple(range(30))
+    text += "x" * 900 + ". End."
+    chunks = chunk_text(text, "T")
+
+    bodies = [c.removeprefix("T\n\n") for c in chunks]
+    for prev, cur in zip(bodies, bodies[1:]):
+        assert cur not in prev
+
+
+def test_chunks_respect_size_and_overlap():
+    text = " ".join(f"Sentence {i} has a few words in it." for i in range(200))
+    chunks = chunk_text(text, "T", chunk_size=800, overlap=200)
+
+    bodies = [c.removeprefix("T\n\n") for c in chunks]
+    assert all(len(b) <= 800 for b in bodies)
+    # Consecutive chunks overlap, and each starts at a sentence
+    for prev, cur in zip(bodies, bodies[1:]):
+        assert cur.startswith("Sentence")
+        assert cur[:30] in prev
+
+
+def test_short_text_is_dropped():
+    assert chunk_text("Too short.", "T") == []
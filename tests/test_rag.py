@@ -0,0 +1,191 @@
+"""Tests for the RAG pipeline's answer cache, retrieval batcher, and dedupe."""
+
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from backend import rag as rag_module
+from backend.rag import RAGPipeline
+from indexer.embed import EMBED_DIM
+
+HISTORY = [{"role": "user", "content": "Earlier question"}]
+
+
+class StubEmbedder:
+    """Deterministic unit vectors: equal texts match, different texts don't."""
+
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=True):
+        single = isinstance(sentences, str)
+        batch = [sentences] if single else list(sentences)
+        self.calls.append(batch)
+        if self.error is not None:
+            raise self.error
+
+        rows = []
+        for text in batch:
+            seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+            rows.append(np.random.default_rng(seed).standard_normal(EMBED_DIM))
+        vecs = np.array(rows, dtype=np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        return vecs[0] if single else vecs
+
+
+def make_chunks(urls):
+    return [
+        {
+            "id": f"chunk_{i}",
+            "text": f"Page {url}\n\nBody of chunk {i}.",
+            "metadata": {"url": url, "title": f"Page {url}", "category": "General"},
+        }
+        for i, url in enumerate(urls)
+    ]
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    urls = [f"https://example.org/{i % 5}" for i in range(20)]
+    embeddings = StubEmbedder().encode([f"chunk {i}" for i in range(len(urls))])
+    embedder = StubEmbedder()
+
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    monkeypatch.setattr(rag_module, "get_embedder", lambda: embedder)
+    monkeypatch.setattr(
+        rag_module, "load_search_index", lambda: (embeddings, make_chunks(urls))
+    )
+    return RAGPipeline()
+
+
+def fake_gemini(pipeline, text="An answer."):
+    """Replace the async Gemini client; returns the list of recorded calls."""
+    calls = []
+
+    async def generate_content(**kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(0)
+        return SimpleNamespace(text=text)
+
+    pipeline.aclient = SimpleNamespace(
+        models=SimpleNamespace(generate_content=generate_content)
+    )
+    return calls
+
+
+def test_batch_searches_only_cache_misses(pipeline, monkeypatch):
+    cached = ("Cached answer.", [])
+    pipeline._cache_store(pipeline.embed_query("hit"), None, *cached)
+    selected = []
+    select = pipeline._select
+
+    def counting_select(sims, top_k):
+        selected.append(top_k)
+        return select(sims, top_k)
+
+    monkeypatch.setattr(pipeline, "_select", counting_select)
+
+    hit, miss = pipeline.retrieve_batch(["hit", "miss"], [6, 6], [None, None])
+
+    assert hit[1] == cached and hit[2] == [] and hit[3] == []
+    assert miss[1] is None and miss[2]
+    assert len(selected) == 1
+
+
+def test_chat_history_bypasses_cache(pipeline):
+    embedding = pipeline.embed_query("question")
+    pipeline._cache_store(embedding, HISTORY, "Follow-up answer.", [])
+    assert pipeline._cache_entries == []
+
+    pipeline._cache_store(embedding, None, "Standalone answer.", [])
+    (result,) = pipeline.retrieve_batch(["question"], [6], [HISTORY])
+    assert result[1] is None and result[2]
+
+
+def test_lru_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(rag_module, "CACHE_MAX_ENTRIES", 2)
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    embedder = StubEmbedder()
+    monkeypatch.setattr(rag_module, "get_embedder", lambda: embedder)
+    monkeypatch.setattr(
+        rag_module,
+        "load_search_index",
+        lambda: (np.zeros((0, EMBED_DIM), dtype=np.float32), []),
+    )
+    pipeline = RAGPipeline()
+    a, b, c = (pipeline.embed_query(q) for q in ("a", "b", "c"))
+
+    pipeline._cache_store(a, None, "A", [])
+    pipeline._cache_store(b, None, "B", [])
+    assert pipeline._cache_lookup(a) == ("A", [])
+    pipeline._cache_store(c, None, "C", [])
+
+    assert pipeline._cache_lookup(b) is None
+    assert pipeline._cache_lookup(a) == ("A", [])
+    assert pipeline._cache_lookup(c) == ("C", [])
+
+
+def test_empty_and_duplicate_answers_are_not_stored(pipeline):
+    embedding = pipeline.embed_query("question")
+    pipeline._cache_store(embedding, None, "", [])
+    pipeline._cache_store(embedding, None, rag_module.NO_ANSWER, [])
+    assert pipeline._cache_entries == []
+
+    pipeline._cache_store(embedding, None, "First.", [])
+    pipeline._cache_store(embedding, None, "Second.", [])
+    assert pipeline._cache_entries == [("First.", [])]
+
+
+def test_concurrent_identical_questions_share_one_entry(pipeline):
+    fake_gemini(pipeline)
+    questions = [f"question {i % 5}" for i in range(20)]
+
+    async def run():
+        try:
+            return await asyncio.gather(*(pipeline.aquery(q) for q in questions))
+        finally:
+            await pipeline.aclose()
+
+    answers = asyncio.run(run())
+
+    assert all(answer == "An answer." for answer, _ in answers)
+    assert len(pipeline._cache_entries) == 5
+    # Concurrent callers were coalesced into batched encode calls
+    assert len(pipeline.embedder.calls) < len(questions)
+
+
+def test_batch_error_reaches_every_caller(pipeline):
+    pipeline.embedder.error = RuntimeError("encoder failed")
+
+    async def run():
+        try:
+            failed = await asyncio.gather(
+                *(pipeline.aretrieve(f"q{i}") for i in range(3)),
+                return_exceptions=True,
+            )
+            # The batcher survives a failed batch
+            pipeline.embedder.error = None
+            recovered = await pipeline.aretrieve("q")
+            return failed, recovered
+        finally:
+            await pipeline.aclose()
+
+    failed, recovered = asyncio.run(run())
+
+    assert all(isinstance(e, RuntimeError) for e in failed)
+    assert recovered[2]
+
+
+def test_select_keeps_at_most_two_chunks_per_url(pipeline):
+    pipeline.chunks = make_chunks(["a", "a", "a", "b", "c", "a", "d"])
+    sims = np.linspace(1.0, 0.4, len(pipeline.chunks))
+
+    contexts, sources = pipeline._select(sims, top_k=4)
+
+    assert [c["id"] for c in contexts] == ["chunk_0", "chunk_1", "chunk_3", "chunk_4"]
+    assert [s.url for s in sources] == ["a", "b", "c"]
+    assert sources[0].quotes == ["Body of chunk 0.", "Body of chunk 1."]